@@ -1,3 +1,6 @@
+import sys
+
+
 class Variable():
 
     ACROSS = "across"
@@ -16,8 +19,13 @@ class Variable():
                  self.j + (k if self.direction == Variable.ACROSS else 0))
             )
 
+        # Variables are used as dict and set keys throughout the solver;
+        # hashing the identifying tuple once here makes every lookup a
+        # stored-value read instead of a fresh tuple hash
+        self._hash = hash((self.i, self.j, self.direction, self.length))
+
     def __hash__(self):
-        return hash((self.i, self.j, self.direction, self.length))
+        return self._hash
 
     def __eq__(self, other):
         return (
@@ -57,9 +65,13 @@ class Crossword():
                         row.append(False)
                 self.structure.append(row)
 
-        # Save vocabulary list
+        # Save vocabulary list; interning the words makes the equality
+        # tests inside the solver's set and dict operations identity
+        # comparisons rather than character-by-character ones
         with open(words_file) as f:
-            self.words = set(f.read().upper().splitlines())
+            self.words = set(
+                sys.intern(word) for word in f.read().upper().splitlines()
+            )
 
         # Determine variable set
         self.variables = set()
@@ -1,10 +1,28 @@
+import multiprocessing
+import os
 import sys
 import random
 import time
-import copy
+from collections import Counter, deque
 from crossword import *
 
 
+def _solve_partition(creator, var, values, results):
+    """
+    Worker for parallel solving: restrict `var`'s domain to `values` in
+    this process's copy of `creator`, run the search on it, and report
+    the outcome on the `results` queue.
+    """
+    creator.domains[var] = set(values)
+    creator.refresh_letter_mask(var)
+    try:
+        results.put(creator.backtrack(dict()))
+    except BaseException:
+        # Report the failure so the parent is not left waiting forever
+        results.put(None)
+        raise
+
+
 class CrosswordCreator():
 
     def __init__(self, crossword):
@@ -12,11 +30,75 @@ class CrosswordCreator():
         Create new CSP crossword generate.
         """
         self.crossword = crossword
+
+        # Vocabulary partitioned by word length, built once; domains
+        # start out node-consistent straight from these buckets.  The
+        # buckets are shared between variables of the same length rather
+        # than copied: domains are only ever narrowed by rebinding to a
+        # fresh set (revise, backtrack), never mutated in place, so the
+        # buckets stay intact
+        self._by_len = dict()
+        for word in crossword.words:
+            self._by_len.setdefault(len(word), set()).add(word)
         self.domains = {
-            var: self.crossword.words.copy()
+            var: self._by_len.get(var.length, set())
+            for var in self.crossword.variables
+        }
+
+        # For each variable, a bitmask per position of the letters that
+        # appear there across the current domain
+        self.letter_mask = dict()
+        for var in self.crossword.variables:
+            self.refresh_letter_mask(var)
+
+        # Neighbor sets and overlap positions, memoized locally so the
+        # hot paths never recompute them through the crossword object
+        self._neighbors = {
+            var: frozenset(crossword.neighbors(var))
+            for var in crossword.variables
+        }
+        self._overlap = dict(crossword.overlaps)
+
+        # Degree of every variable, precomputed so the tiebreak in
+        # select_unassigned_variable is an O(1) lookup
+        self._degree = {
+            var: len(self._neighbors[var])
             for var in self.crossword.variables
         }
 
+        # For each variable, a multiset counting, per assigned variable,
+        # how many of its domain values are currently pruned because of
+        # that variable's assignment (directly or through propagation).
+        # backtrack's backjumping needs this to know every assignment
+        # implicated in a dead end, including those whose earlier
+        # propagation emptied values out of the domain before the dead
+        # end's frame ever opened
+        self._pruned_by = {
+            var: Counter() for var in self.crossword.variables
+        }
+
+        # Words currently used by the assignment being searched, kept in
+        # sync by backtrack so distinctness checks are O(1)
+        self._used_values = set()
+
+        # Memoized order_domain_values results; backjumping and MRV make
+        # the search revisit identical (variable, neighborhood, domain)
+        # states, where the ordering is identical too.  Bounded with
+        # first-in-first-out eviction
+        self._lcv_cache = dict()
+        self._lcv_cache_size = 4096
+
+        # Inverted index over the vocabulary: (length, position, letter)
+        # maps to the set of words of that length carrying that letter
+        # at that position; built once, never mutated
+        self.index = dict()
+        for word in self.crossword.words:
+            length = len(word)
+            for pos in range(length):
+                self.index.setdefault(
+                    (length, pos, word[pos]), set()
+                ).add(word)
+
     def letter_grid(self, assignment):
         """
         Return 2D array representing a given assignment.
@@ -50,107 +132,250 @@ class CrosswordCreator():
         """
         Save crossword assignment to an image file.
         """
+        import numpy as np
         from PIL import Image, ImageDraw, ImageFont
         cell_size = 100
         cell_border = 2
         interior_size = cell_size - 2 * cell_border
         letters = self.letter_grid(assignment)
 
-        # Create a blank canvas
-        img = Image.new(
-            "RGBA",
-            (self.crossword.width * cell_size,
-             self.crossword.height * cell_size),
-            "black"
+        # Rasterize the whole board in one shot: a black canvas with the
+        # white cell interiors stamped in by scaling the structure mask
+        # up to pixel size, instead of one draw call per cell
+        canvas = np.zeros(
+            (self.crossword.height * cell_size,
+             self.crossword.width * cell_size, 4),
+            dtype=np.uint8
+        )
+        canvas[..., 3] = 255
+        structure = np.array(self.crossword.structure, dtype=bool)
+        interior = np.pad(
+            np.ones((interior_size, interior_size), dtype=bool),
+            cell_border
         )
+        canvas[np.kron(structure, interior)] = (255, 255, 255, 255)
+
+        img = Image.fromarray(canvas, "RGBA")
         font = ImageFont.truetype("assets/fonts/OpenSans-Regular.ttf", 80)
         draw = ImageDraw.Draw(img)
 
         for i in range(self.crossword.height):
             for j in range(self.crossword.width):
-
-                rect = [
-                    (j * cell_size + cell_border,
-                     i * cell_size + cell_border),
-                    ((j + 1) * cell_size - cell_border,
-                     (i + 1) * cell_size - cell_border)
-                ]
-                if self.crossword.structure[i][j]:
-                    draw.rectangle(rect, fill="white")
-                    if letters[i][j]:
-                        w, h = draw.textsize(letters[i][j], font=font)
-                        draw.text(
-                            (rect[0][0] + ((interior_size - w) / 2),
-                             rect[0][1] + ((interior_size - h) / 2) - 10),
-                            letters[i][j], fill="black", font=font
-                        )
+                if self.crossword.structure[i][j] and letters[i][j]:
+                    w, h = draw.textsize(letters[i][j], font=font)
+                    draw.text(
+                        (j * cell_size + cell_border
+                         + ((interior_size - w) / 2),
+                         i * cell_size + cell_border
+                         + ((interior_size - h) / 2) - 10),
+                        letters[i][j], fill="black", font=font
+                    )
 
         img.save(filename)
 
-    def solve(self):
+    def solve(self, workers=None):
         """
         Enforce node and arc consistency, and then solve the CSP.
+
+        If `workers` is greater than 1, the domain of the root variable
+        is split into that many chunks (capped at the CPU count) and
+        each chunk is searched in its own process; the first complete
+        assignment found wins and the remaining workers are terminated.
+        Value choice at the top of the tree is the only coordination
+        point, so the workers share nothing.
         """
         self.enforce_node_consistency()
         self.ac3()
+        if workers is not None and workers > 1:
+            return self._solve_parallel(workers)
         return self.backtrack(dict())
 
+    def _solve_parallel(self, workers):
+        """
+        Partition the root variable's domain into contiguous chunks and
+        run `backtrack` on each in a separate process.
+        """
+        # Nothing to partition on a puzzle with no variables
+        assignment = dict()
+        if self.assignment_complete(assignment):
+            return assignment
+        var = self.select_unassigned_variable(assignment)
+        values = self.order_domain_values(var, assignment)
+        if not values:
+            return None
+        workers = min(workers, os.cpu_count() or 1, len(values))
+        if workers < 2:
+            return self.backtrack(dict())
+        chunk = -(-len(values) // workers)
+        partitions = [
+            values[k:k + chunk] for k in range(0, len(values), chunk)
+        ]
+        results = multiprocessing.SimpleQueue()
+        processes = [
+            multiprocessing.Process(
+                target=_solve_partition,
+                args=(self, var, partition, results)
+            )
+            for partition in partitions
+        ]
+        for process in processes:
+            process.start()
+        try:
+            result = None
+            for _ in range(len(processes)):
+                result = results.get()
+                if result is not None:
+                    break
+            return result
+        finally:
+            # Kill the siblings outright once the answer is in: a pool
+            # shutdown can only cancel work that has not started, and a
+            # worker stuck on an unsolvable partition would otherwise
+            # keep the interpreter alive until it finished
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
+            results.close()
+
     def enforce_node_consistency(self):
         """
         Update `self.domains` such that each variable is node-consistent.
         (Remove any values that are inconsistent with a variable's unary
          constraints; in this case, the length of the word.)
+
+        Domains are built node-consistent from the per-length buckets in
+        `__init__`; this resets them to that state (sharing the buckets,
+        which are narrowed only by rebinding - see `__init__`).
         """
         for var in self.crossword.variables:
-            for value in self.crossword.words:
-                if len(value) != var.length:
-                    self.domains[var].remove(value)
+            self.domains[var] = self._by_len.get(var.length, set())
+            self.refresh_letter_mask(var)
+            self._pruned_by[var] = Counter()
 
-    def revise(self, x, y):
+    def refresh_letter_mask(self, var):
+        """
+        Recompute `self.letter_mask[var]` from the variable's current
+        domain: one integer per position whose set bits are the letters
+        occurring at that position.
+        """
+        mask = [0] * var.length
+        for word in self.domains[var]:
+            for k in range(var.length):
+                # ord & 31 maps "A"-"Z" onto bits 1-26
+                mask[k] |= 1 << (ord(word[k]) & 31)
+        self.letter_mask[var] = mask
+
+    def revise(self, x, y, trail=None):
         """
         Make variable `x` arc consistent with variable `y`.
         To do so, remove values from `self.domains[x]` for which there is no
         possible corresponding value for `y` in `self.domains[y]`.
 
+        If `trail` is given, every removed value is recorded on it as an
+        `(x, value, culprits)` triple so the removal can be undone later,
+        where `culprits` holds the assigned variables the removal is
+        charged to: a value loses its support in y's current domain, so
+        it is implicated in exactly the assignments that shaped that
+        domain - y's current pruners.
+
         Return True if a revision was made to the domain of `x`; return
         False if no revision was made.
         """
-        revised = False
-        overlap = self.crossword.overlaps[x, y]
-        for xvalue in self.domains[x].copy():
-            self.domains[x].remove(xvalue)
-            revised = True
-            for yvalue in self.domains[y]:
-                if xvalue[overlap[0]] == yvalue[overlap[1]]:
-                    self.domains[x].add(xvalue)
-                    revised = False
-                    break
+        i, j = self._overlap[x, y]
+
+        # Characters available at position j among y's values, then the
+        # words allowed at x straight from the inverted index: one union
+        # per distinct letter instead of a scan over x's domain per value
+        y_chars = {yvalue[j] for yvalue in self.domains[y]}
+        allowed = set()
+        for char in y_chars:
+            allowed |= self.index.get((x.length, i, char), set())
+
+        new_domain = self.domains[x] & allowed
+        revised = len(new_domain) != len(self.domains[x])
+        if revised:
+            if trail is not None:
+                culprits = frozenset(self._pruned_by[y])
+                removed_values = self.domains[x] - new_domain
+                pruned = self._pruned_by[x]
+                for removed in removed_values:
+                    trail.append((x, removed, culprits))
+                for culprit in culprits:
+                    pruned[culprit] += len(removed_values)
+            self.domains[x] = new_domain
+            self.refresh_letter_mask(x)
         return revised
 
-    def ac3(self, arcs=None):
+    def restore(self, trail):
+        """
+        Undo the domain removals recorded on `trail` (newest first),
+        re-adding each removed value to its variable's domain and
+        dropping the charges against the removal's culprits.
+        """
+        for var, value, culprits in reversed(trail):
+            self.domains[var].add(value)
+            mask = self.letter_mask.get(var)
+            if mask is not None:
+                for k in range(var.length):
+                    mask[k] |= 1 << (ord(value[k]) & 31)
+            if culprits:
+                pruned = self._pruned_by[var]
+                for culprit in culprits:
+                    pruned[culprit] -= 1
+                    if not pruned[culprit]:
+                        del pruned[culprit]
+
+    def ac3(self, arcs=None, trail=None):
         """
         Update `self.domains` such that each variable is arc consistent.
         If `arcs` is None, begin with initial list of all arcs in the problem.
         Otherwise, use `arcs` as the initial list of arcs to make consistent.
 
+        If `trail` is given, it is passed on to `revise` so all removals
+        are recorded and can be undone with `restore`.
+
         Return True if arc consistency is enforced and no domains are empty;
         return False if one or more domains end up empty.
-        """        
+        """
         # Check if arguments arc is passed. If not create arcs
         if arcs == None:
-            queue = self.create_arcs()
-        else:
-            queue = arcs
+            arcs = self.create_arcs()
+        queue = deque(arcs)
+
+        # Arcs currently sitting in the queue, so the re-enqueue guard is
+        # an O(1) set probe instead of a linear scan of the queue
+        in_queue = set(queue)
+
+        # Hoist the per-iteration attribute lookups out of the loop
+        domains = self.domains
+        letter_mask = self.letter_mask
+        overlap = self._overlap
+        neighbors = self._neighbors
+        revise = self.revise
 
         # AC-3 iteration
         while queue:
-            x, y = queue.pop()
-            if self.revise(x, y):
-                if len(self.domains[x]) == 0:
+            arc = queue.popleft()
+            in_queue.discard(arc)
+            x, y = arc
+
+            # Skip the arc when every letter x allows at the overlap is
+            # also allowed by y there: revise could not prune anything
+            mask_x = letter_mask.get(x)
+            mask_y = letter_mask.get(y)
+            if mask_x is not None and mask_y is not None:
+                i, j = overlap[x, y]
+                if mask_x[i] & mask_y[j] == mask_x[i]:
+                    continue
+
+            if revise(x, y, trail):
+                if len(domains[x]) == 0:
                     return False
-                for z in self.crossword.neighbors(x) - {y}:
-                    if (z, x) not in queue:
+                for z in neighbors[x] - {y}:
+                    if (z, x) not in in_queue:
                         queue.append((z, x))
+                        in_queue.add((z, x))
         return True
 
     def assignment_complete(self, assignment):
@@ -168,28 +393,48 @@ class CrosswordCreator():
         puzzle without conflicting characters); return False otherwise.
         """
         # Check if every value in assignment is distinct
-        for element in assignment:
-            for confront in {key:val for key, val in assignment.items() if key != element}:
-                if assignment[element] == assignment[confront]:
-                    return False
+        if len(set(assignment.values())) != len(assignment):
+            return False
 
-        # Check if node consistency is maintained
-        for element in assignment:
-            if len(assignment[element]) != element.length:
+        # Check node consistency and arc consistency with other assigned
+        # variables in a single pass over the assignment
+        for element, element_value in assignment.items():
+            if len(element_value) != element.length:
                 return False
-
-        # Check if arc-consistency with other assigned variables is maintained
-        for element in assignment:
-            element_value = assignment[element]
-            for neighbor in self.crossword.neighbors(element):
+            for neighbor in self._neighbors[element]:
                 if neighbor in assignment:
-                    overlap = self.crossword.overlaps[element, neighbor]
+                    overlap = self._overlap[element, neighbor]
                     neighbor_value = assignment[neighbor]
                     if element_value[overlap[0]] != neighbor_value[overlap[1]]:
                         return False
 
         return True
 
+    def _conflicting_variable(self, assignment, var):
+        """
+        Return an already-assigned variable whose value conflicts with
+        `var`'s new value, or None if the binding is consistent (only
+        the constraints touching `var` can be newly violated: its word
+        length, distinctness against `self._used_values`, and the
+        overlaps with its already-assigned neighbors).  A violation of
+        `var`'s own unary length constraint is reported as `var`
+        itself.  backtrack uses the culprits to build conflict sets for
+        backjumping.
+        """
+        value = assignment[var]
+        if len(value) != var.length:
+            return var
+        if value in self._used_values:
+            for other, other_value in assignment.items():
+                if other != var and other_value == value:
+                    return other
+        for neighbor in self._neighbors[var]:
+            if neighbor in assignment:
+                overlap = self._overlap[var, neighbor]
+                if value[overlap[0]] != assignment[neighbor][overlap[1]]:
+                    return neighbor
+        return None
+
     def order_domain_values(self, var, assignment):
         """
         Return a list of values in the domain of `var`, in order by
@@ -197,20 +442,42 @@ class CrosswordCreator():
         The first value in the list, for example, should be the one
         that rules out the fewest values among the neighbors of `var`.
         """
-        helper_list = list()
-        values = self.domains[var].copy()
-        neighbors_to_check = self.crossword.neighbors(var) - set(assignment)
-        while values:
-            count = 0
-            value = values.pop()
-            for neighbor in neighbors_to_check:
-                overlap = self.crossword.overlaps[var, neighbor]
-                for confront in self.domains[neighbor]:
-                    if value[overlap[0]] != confront[overlap[1]]:
-                        count += 1
-            helper_list.append((value, count))
-        helper_list.sort(key=lambda x: x[1])
-        return [key for key, val in helper_list]
+        # The ordering only depends on var's domain and the values bound
+        # to its neighbors, so identical states hit the cache
+        key = (
+            var,
+            frozenset(
+                (neighbor, assignment[neighbor])
+                for neighbor in self._neighbors[var]
+                if neighbor in assignment
+            ),
+            frozenset(self.domains[var]),
+        )
+        cached = self._lcv_cache.get(key)
+        if cached is not None:
+            return cached
+
+        # One histogram per unassigned neighbor of the letters at its
+        # overlap position: the number of neighbor values a candidate
+        # rules out is then total - histogram[candidate letter], without
+        # rescanning the neighbor's domain for every candidate
+        histograms = []
+        for neighbor in self._neighbors[var] - set(assignment):
+            i, j = self._overlap[var, neighbor]
+            counts = Counter(word[j] for word in self.domains[neighbor])
+            histograms.append((len(self.domains[neighbor]), counts, i))
+
+        def ruled_out(value):
+            return sum(
+                total - counts.get(value[i], 0)
+                for total, counts, i in histograms
+            )
+
+        ordered = sorted(self.domains[var], key=ruled_out)
+        if len(self._lcv_cache) >= self._lcv_cache_size:
+            self._lcv_cache.pop(next(iter(self._lcv_cache)))
+        self._lcv_cache[key] = ordered
+        return ordered
 
     def select_unassigned_variable(self, assignment):
         """
@@ -220,14 +487,14 @@ class CrosswordCreator():
         degree. If there is a tie, any of the tied variables are acceptable
         return values.
         """
-        threshold = 0
-        for variable in self.crossword.variables:
-            if variable not in assignment:
-                number_of_neighbors = len(self.crossword.neighbors(variable))
-                if number_of_neighbors > threshold:
-                    selected_variable = variable
-                    threshold = number_of_neighbors
-        return selected_variable        
+        unassigned = [
+            variable for variable in self.crossword.variables
+            if variable not in assignment
+        ]
+        return min(
+            unassigned,
+            key=lambda v: (len(self.domains[v]), -self._degree[v])
+        )
 
     def backtrack(self, assignment):
         """
@@ -237,55 +504,140 @@ class CrosswordCreator():
         `assignment` is a mapping from variables (keys) to words (values).
 
         If no assignment is possible, return None.
+
+        The search runs as an explicit-stack loop rather than a
+        recursion, so depth is bounded by memory instead of the
+        interpreter's recursion limit and no call frames are allocated
+        per node.  Each stack frame holds the variable chosen at that
+        depth, the iterator over its ordered values, the conflict set
+        used for backjumping, and the length to rewind the shared trail
+        to when a value is abandoned.  A frame's conflict set gathers
+        the direct culprits of its rejected values and, at exhaustion,
+        the pruners of the values it never got to try (`_pruned_by`), so
+        the jump never skips an assignment that could have mattered.
         """
         if self.assignment_complete(assignment):
             return assignment
-        var = self.select_unassigned_variable(assignment)
-        orderedlist = self.order_domain_values(var, assignment)
-        for value in orderedlist:
-            assignment[var] = value            
-            if self.consistent(assignment):
 
-                # Inference
-                arcs = self.create_arcs(var, assignment)
+        # Values bound in the input assignment count toward distinctness
+        # from the start
+        self._used_values = set(assignment.values())
+
+        trail = []
+        frames = []
+
+        def open_frame():
+            var = self.select_unassigned_variable(assignment)
+            frames.append((
+                var,
+                iter(self.order_domain_values(var, assignment)),
+                set(),
+                len(trail),
+            ))
+
+        def rewind(length):
+            self.restore(trail[length:])
+            del trail[length:]
+
+        open_frame()
+        while frames:
+            var, values, conflicts, base = frames[-1]
+            advanced = False
+            for value in values:
+                assignment[var] = value
+                culprit = self._conflicting_variable(assignment, var)
+                if culprit is not None:
+                    if culprit != var:
+                        conflicts.add(culprit)
+                    assignment.pop(var)
+                    continue
+                self._used_values.add(value)
+
+                # Forward checking: narrow the chosen variable's domain
+                # to the assigned value and revise just the arcs from its
+                # unassigned neighbors toward it, recording every removal
+                # on the trail so failure only costs rewinding it
+                arcs = [
+                    (neighbor, var)
+                    for neighbor in self._neighbors[var]
+                    if neighbor not in assignment
+                ]
+                wiped = False
                 if arcs != []:
-                    domains_backup = copy.deepcopy(self.domains)
-                    for element in assignment:
-                        self.domains[element] = {assignment[element]}
-                    if self.ac3(arcs) == False:
-                        self.domains = copy.deepcopy(domains_backup)
-
-                result = self.backtrack(assignment)
-                if result != None:
-                    return result
-            assignment.pop(var)
+                    # The narrowing is due to this assignment alone, so
+                    # its removals are charged to the variable itself
+                    culprits = frozenset((var,))
+                    removed_values = self.domains[var] - {value}
+                    for removed in removed_values:
+                        trail.append((var, removed, culprits))
+                    self._pruned_by[var][var] += len(removed_values)
+                    self.domains[var] = {value}
+                    self.refresh_letter_mask(var)
+                    if self.ac3(arcs, trail) == False:
+                        # A wipeout after propagation cannot be pinned on
+                        # specific variables; charge every assigned one
+                        conflicts.update(
+                            other for other in assignment if other != var
+                        )
+                        wiped = True
+                if wiped:
+                    rewind(base)
+                    self._used_values.discard(value)
+                    assignment.pop(var)
+                    continue
+
+                if self.assignment_complete(assignment):
+                    return assignment
+                open_frame()
+                advanced = True
+                break
+
+            if advanced:
+                continue
+
+            # Every value at this depth failed: drop the frame and jump
+            # back to the deepest variable implicated in the conflicts,
+            # unwinding (and skipping) the uninvolved levels in between.
+            # The values this frame never got to try - those pruned from
+            # the domain before it opened - implicate their pruners too,
+            # since undoing one of those assignments could bring a
+            # working value back
+            frames.pop()
+            rewind(base)
+            conflicts.update(self._pruned_by[var])
+            while frames:
+                parent_var, _, parent_conflicts, parent_base = frames[-1]
+                rewind(parent_base)
+                self._used_values.discard(assignment.pop(parent_var))
+                if parent_var in conflicts:
+                    conflicts.discard(parent_var)
+                    parent_conflicts |= conflicts
+                    break
+                frames.pop()
         return None
     
-    def create_arcs(self, var=None, assignment=set()):
+    def create_arcs(self, var=None, assignment=None):
         """
-        Creates arcs to be used in AC-3. If neither 'var' or 'assignment' are passed
-        arcs among all variables are computed, else only the arcs which connect variable 'var'
-        to the 'neighbors' not in 'assignment' are computed
+        Creates arcs to be used in AC-3. If 'var' is not passed, arcs among
+        all variables are computed; else only the arcs connecting 'var' to
+        its neighbors not in 'assignment' are computed, in both directions
+        so inference propagates to and from the newly assigned variable.
         """
+        assigned = set(assignment) if assignment else set()
+        seen = set()
         arcs = []
-        if var is None:
-            variables = self.crossword.variables
-            for var in variables:
-                for neighbor in (self.crossword.neighbors(var) - set(assignment)):
-                    arc = (var, neighbor)
-                    if arc in arcs:
-                        continue
-                    arcs.append(arc)
-            return arcs
-        else:
-            variables = {var}       
-            for var in variables:
-                for neighbor in (self.crossword.neighbors(var) - set(assignment)):
-                    arc = (neighbor, var)
-                    if arc in arcs:
-                        continue
-                    arcs.append(arc)
-            return arcs
+        variables = self.crossword.variables if var is None else {var}
+        for v in variables:
+            for neighbor in (self._neighbors[v] - assigned):
+                if var is None:
+                    pairs = ((v, neighbor),)
+                else:
+                    pairs = ((v, neighbor), (neighbor, v))
+                for arc in pairs:
+                    if arc not in seen:
+                        seen.add(arc)
+                        arcs.append(arc)
+        return arcs
 
 
 def main():